@@ -0,0 +1,256 @@
+"""
+Evaluate matching accuracy, latency, tokens and cost across the configured models.
+
+Every (transcript, expected keyword) pair of a labeled corpus is matched against a
+dictionary through the same call_bedrock path as /bedrock, for each model and
+prompt template variant. Responses can be recorded and replayed offline.
+
+Corpus: JSON lines of {"transcript": "...", "expected": "KEYWORD"} (expected null or
+"" when no match is expected). Dictionary: JSON object of keyword -> variations, as
+produced by /generate_variation. Pricing (optional): JSON object of model name ->
+{"input_per_1k": USD, "output_per_1k": USD}.
+
+Usage:
+    python benchmarks/model_eval.py --corpus corpus.jsonl --dictionary dictionary.json \\
+        [--models nova-micro\\ CRI claude-3-haiku] [--template pe/pe_template.txt ...] \\
+        [--mode live|record|replay] [--recordings recordings.json] \\
+        [--concurrency 4] [--min-accuracy 0.9] [--pricing pricing.json] [--report report.json]
+"""
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_MODELS_CONFIG = os.path.join(os.path.dirname(BACKEND_DIR), "shared", "config", "models_config.json")
+sys.path.insert(0, BACKEND_DIR)
+
+from fastapi import HTTPException
+from services.model_registry import model_registry
+from services.bedrock_service import call_bedrock
+from services.sharded_matching import parse_match_result
+
+# Per-case metrics, filled in by the client wrapper from the Bedrock worker thread
+current_case = contextvars.ContextVar("current_case")
+
+def request_key(request_params):
+    """Stable key of a Converse request, used to look up recorded responses"""
+    return hashlib.sha256(json.dumps(request_params, sort_keys=True, default=str).encode()).hexdigest()
+
+class EvalBedrockClient:
+    """
+    Stand-in for the bedrock-runtime client that records, replays or just measures Converse calls
+    """
+
+    def __init__(self, client, mode, recordings):
+        self.client = client
+        self.mode = mode
+        self.recordings = recordings
+        self.lock = threading.Lock()
+
+    def converse(self, **request_params):
+        key = request_key(request_params)
+        case = current_case.get(None)
+        if self.mode == "replay":
+            if key not in self.recordings:
+                if case is not None:
+                    case["missing_recording"] = True
+                raise KeyError(f"No recorded response for {request_params['modelId']} request {key[:12]}")
+            entry = self.recordings[key]
+        else:
+            start_time = time.time()
+            response = self.client.converse(**request_params)
+            entry = {"latency": time.time() - start_time, "response": response}
+            if self.mode == "record":
+                with self.lock:
+                    self.recordings[key] = entry
+
+        if case is not None:
+            usage = entry["response"].get("usage", {})
+            case["latency"] = entry["latency"]
+            case["input_tokens"] = usage.get("inputTokens", 0)
+            case["output_tokens"] = usage.get("outputTokens", 0)
+        return entry["response"]
+
+class EvalSession:
+    """
+    Session handed to call_bedrock; its bedrock-runtime client is wrapped by EvalBedrockClient
+    """
+
+    def __init__(self, session, mode, recordings):
+        self.session = session
+        self.mode = mode
+        self.recordings = recordings
+
+    def client(self, service_name, **kwargs):
+        client = self.session.client(service_name, **kwargs) if self.session is not None else None
+        if service_name == 'bedrock-runtime':
+            return EvalBedrockClient(client, self.mode, self.recordings)
+        return client
+
+def aws_session():
+    """Instance-role credentials as in the server, falling back to the default credential chain"""
+    from services.aws_utils import get_temporary_credentials
+    try:
+        session, _ = get_temporary_credentials()
+        return session
+    except HTTPException:
+        import boto3
+        return boto3.Session()
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def is_correct(result, expected):
+    match = parse_match_result(result)
+    if not expected:
+        return match is None
+    return match is not None and match["word"].strip().upper() == expected.strip().upper()
+
+async def evaluate(corpus, system_prompt, session, model_name, concurrency):
+    """Run the corpus through call_bedrock for one model and prompt, returning per-case records"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_case(item):
+        case = {"transcript": item["transcript"], "expected": item.get("expected")}
+        current_case.set(case)
+        async with semaphore:
+            try:
+                case["result"] = await call_bedrock(item["transcript"], system_prompt, session, model_name)
+                case["correct"] = is_correct(case["result"], case["expected"])
+            except HTTPException as e:
+                case["error"] = e.detail
+                case["correct"] = False
+        return case
+
+    return await asyncio.gather(*(run_case(item) for item in corpus))
+
+def summarize(cases, model_name, template_name, pricing):
+    # Cases without a recording say nothing about the model, keep them out of the accuracy
+    scored = [c for c in cases if not c.get("missing_recording")]
+    latencies = [c["latency"] for c in cases if "latency" in c]
+    input_tokens = sum(c.get("input_tokens", 0) for c in cases)
+    output_tokens = sum(c.get("output_tokens", 0) for c in cases)
+    summary = {
+        "model": model_name,
+        "template": template_name,
+        "cases": len(cases),
+        "errors": sum(1 for c in scored if "error" in c),
+        "missing_recordings": len(cases) - len(scored),
+        "accuracy": sum(1 for c in scored if c["correct"]) / len(scored) if scored else 0.0,
+        "p50_latency": percentile(latencies, 0.5),
+        "p95_latency": percentile(latencies, 0.95),
+        "mean_latency": statistics.mean(latencies) if latencies else None,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cost": None,
+    }
+    price = pricing.get(model_name)
+    if price:
+        summary["cost"] = input_tokens / 1000 * price["input_per_1k"] + output_tokens / 1000 * price["output_per_1k"]
+    return summary
+
+def print_report(summaries, min_accuracy):
+    def fmt(value, pattern):
+        return pattern.format(value) if value is not None else "-"
+
+    print(f"{'model':<28} {'template':<24} {'acc':>6} {'p50 ms':>8} {'p95 ms':>8} {'in tok':>8} {'out tok':>8} {'cost $':>9} {'err':>4}")
+    for s in summaries:
+        print(f"{s['model']:<28} {s['template']:<24} {s['accuracy']:>6.1%} "
+              f"{fmt(s['p50_latency'] and s['p50_latency'] * 1000, '{:.0f}'):>8} "
+              f"{fmt(s['p95_latency'] and s['p95_latency'] * 1000, '{:.0f}'):>8} "
+              f"{s['input_tokens']:>8} {s['output_tokens']:>8} {fmt(s['cost'], '{:.4f}'):>9} {s['errors']:>4}")
+
+    if min_accuracy is not None:
+        eligible = [s for s in summaries if s["accuracy"] >= min_accuracy and s["p50_latency"] is not None]
+        if eligible:
+            best = min(eligible, key=lambda s: s["p50_latency"])
+            print(f"\nFastest meeting {min_accuracy:.0%} accuracy: {best['model']} with {best['template']} "
+                  f"(p50 {best['p50_latency'] * 1000:.0f} ms, accuracy {best['accuracy']:.1%})")
+        else:
+            print(f"\nNo model/template reached {min_accuracy:.0%} accuracy")
+
+async def run(args):
+    if args.models_config:
+        model_registry.path = args.models_config
+    elif not os.path.exists(model_registry.path):
+        # Outside the container, use the repository's model configuration
+        model_registry.path = REPO_MODELS_CONFIG
+    model_registry.reload()
+    model_names = args.models or model_registry.names()
+    if not model_names:
+        raise SystemExit(f"No models configured in {model_registry.path}")
+    unknown = [name for name in model_names if name not in model_registry]
+    if unknown:
+        raise SystemExit(f"Unknown models: {', '.join(unknown)}")
+
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    with open(args.dictionary, 'r', encoding='utf-8') as f:
+        dictionary = json.dumps(json.load(f), ensure_ascii=False)
+    pricing = {}
+    if args.pricing:
+        with open(args.pricing, 'r', encoding='utf-8') as f:
+            pricing = json.load(f)
+
+    recordings = {}
+    if args.mode != "live" and os.path.exists(args.recordings):
+        with open(args.recordings, 'r', encoding='utf-8') as f:
+            recordings = json.load(f)
+    session = EvalSession(None if args.mode == "replay" else aws_session(), args.mode, recordings)
+
+    summaries = []
+    for template_path in args.template:
+        with open(template_path, 'r', encoding='utf-8') as f:
+            system_prompt = f.read().strip().replace("{generate_result}", dictionary)
+        template_name = os.path.basename(template_path)
+        for model_name in model_names:
+            cases = await evaluate(corpus, system_prompt, session, model_name, args.concurrency)
+            summaries.append({**summarize(cases, model_name, template_name, pricing), "details": cases})
+
+    if args.mode == "record":
+        with open(args.recordings, 'w', encoding='utf-8') as f:
+            json.dump(recordings, f, default=str)
+
+    print_report(summaries, args.min_accuracy)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2, ensure_ascii=False, default=str)
+
+    missing = sum(s["missing_recordings"] for s in summaries)
+    if missing:
+        raise SystemExit(f"{missing} cases have no recorded response in {args.recordings}, "
+                         f"record them again with --mode record")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--corpus", required=True)
+    arg_parser.add_argument("--dictionary", required=True)
+    arg_parser.add_argument("--models", nargs="*", help="Model names (default: all configured models)")
+    arg_parser.add_argument("--models-config",
+                            help="Path to models_config.json (default: MODELS_CONFIG_PATH, else the repository's)")
+    arg_parser.add_argument("--template", action="append", help="Prompt template variant, may be repeated")
+    arg_parser.add_argument("--mode", choices=["live", "record", "replay"], default="live")
+    arg_parser.add_argument("--recordings", default="recordings.json")
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--min-accuracy", type=float)
+    arg_parser.add_argument("--pricing")
+    arg_parser.add_argument("--report")
+    args = arg_parser.parse_args()
+    args.template = args.template or [os.path.join(BACKEND_DIR, "pe", "pe_template.txt")]
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s: %(message)s')
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure backend startup time and first-request latency.
+
+Starts the server in a subprocess, polls the readiness endpoint until it succeeds
+and then times the first and following requests to a given path. The default path
+is /api/bedrock, which goes through credentials, the Bedrock client and a Converse
+call, so the first request shows any cold-start cost left after warm-up. Other
+paths are timed with GET.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--mode serve|dev] [--path /api/bedrock]
+        [--model claude-3-haiku] [--requests 5] [--allow-no-aws]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_MODELS_CONFIG = os.path.join(os.path.dirname(BACKEND_DIR), "shared", "config", "models_config.json")
+
+COMMANDS = {
+    # Production mode: multi-worker, lifespan warm-up, no reloader
+    "serve": [sys.executable, "serve.py"],
+    # Previous mode: single process with reloader
+    "dev": [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--reload"],
+}
+
+def wait_until_ready(base_url, timeout):
+    """Poll the readiness endpoint, returning the time it first succeeded"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=1).status_code == 200:
+                return time.time()
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"Server not ready after {timeout} seconds")
+
+def time_request(url, body=None):
+    start = time.time()
+    if body is not None:
+        response = requests.post(url, json=body, timeout=60)
+    else:
+        response = requests.get(url, timeout=60)
+    return time.time() - start, response.status_code
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--mode", choices=COMMANDS.keys(), default="serve")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--path", default="/api/bedrock", help="Path timed after the server is ready")
+    arg_parser.add_argument("--model", default="claude-3-haiku", help="Model used for /api/bedrock requests")
+    arg_parser.add_argument("--allow-no-aws", action="store_true",
+                            help="Set WARMUP_OPTIONAL so the server becomes ready without AWS access")
+    arg_parser.add_argument("--requests", type=int, default=5, help="Number of timed requests")
+    arg_parser.add_argument("--timeout", type=float, default=120)
+    args = arg_parser.parse_args()
+
+    env = dict(os.environ, PORT=str(args.port))
+    if args.allow_no_aws:
+        env["WARMUP_OPTIONAL"] = "1"
+    # Outside the container, use the repository's model configuration
+    if "MODELS_CONFIG_PATH" not in env and not os.path.exists("/app/shared/config/models_config.json"):
+        env["MODELS_CONFIG_PATH"] = REPO_MODELS_CONFIG
+    body = None
+    if args.path == "/api/bedrock":
+        body = {
+            "transcript": "Hagen dass",
+            "system_prompt": 'Match the text. <dictionary>{"HAAGEN-DAZS": ["Hagen Dass."]}</dictionary>',
+            "model_name": args.model,
+        }
+    command = COMMANDS[args.mode] + (["--port", str(args.port)] if args.mode == "dev" else [])
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    start = time.time()
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready_at = wait_until_ready(base_url, args.timeout)
+        results = [time_request(f"{base_url}{args.path}", body) for _ in range(args.requests)]
+        latencies = [latency for latency, _ in results]
+
+        print(f"Mode:                  {args.mode}")
+        print(f"Startup time:          {ready_at - start:.3f} s")
+        print(f"First request latency: {latencies[0] * 1000:.1f} ms (status {results[0][1]})")
+        if len(latencies) > 1:
+            print(f"Warm request median:   {statistics.median(latencies[1:]) * 1000:.1f} ms")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+if __name__ == "__main__":
+    main()
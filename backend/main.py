@@ -1,27 +1,100 @@
 import logging
+import hmac
 import json
+import os
 import random
 import string
 import re
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Depends
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from urllib.parse import urlparse
 import asyncio
 
 # Import custom modules from services directory
-from services.config import SUPPORTED_MODELS
+from services.model_registry import model_registry
 from services.logging_utils import setup_logging
-from services.aws_utils import get_temporary_credentials, get_ec2_role, get_aws_region
+from services.aws_utils import get_session_credentials, get_ec2_role, get_aws_region, get_aws_client, warm_up_aws
 from services.bedrock_service import call_bedrock
 from services.transcription_service import transcribe_audio
+from services.sharded_matching import sharded_match
+from services.batch_matching import batch_match
+from services.config import (
+    MAX_BATCH_TRANSCRIPTS,
+    ADMIN_TOKEN_HEADER,
+    ADMIN_TOKEN,
+    WARMUP_OPTIONAL,
+    WARMUP_RETRY_INTERVAL,
+)
+from services.profiling import ProfilingMiddleware, request_profiler, loop_watchdog, is_valid_request_id
+from services.deadline_utils import get_request_deadline, run_with_deadline
 
 # Setup logging
 setup_logging()
 
+async def warm_up_until_ready(app: FastAPI, start_time: float, retry: bool):
+    """
+    Warm up AWS credentials, clients and connections and then mark the worker ready.
+
+    With `retry`, failed attempts are repeated every WARMUP_RETRY_INTERVAL seconds and
+    the worker stays unready meanwhile. With WARMUP_OPTIONAL set (local development
+    without AWS access) a failure is logged and the worker is marked ready anyway.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(warm_up_aws)
+            break
+        except Exception as e:
+            if WARMUP_OPTIONAL:
+                logging.warning(f"AWS warm-up failed, continuing because WARMUP_OPTIONAL is set: {e}")
+                break
+            if not retry:
+                raise
+            logging.error(f"AWS warm-up failed, retrying in {WARMUP_RETRY_INTERVAL}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+    app.state.ready = True
+    logging.info(f"Worker warm-up completed in {time.time() - start_time:.2f} seconds")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up the worker before it reports ready"""
+    start_time = time.time()
+    app.state.ready = False
+
+    # Prompt templates and model registry; a missing template only fails its endpoints
+    for read_prompt in (read_template, read_llm_generate_dict):
+        try:
+            read_prompt()
+        except HTTPException as e:
+            logging.error(f"Prompt template not preloaded: {e.detail}")
+    try:
+        model_registry.reload()
+    except Exception as e:
+        logging.error(f"Models configuration not loaded, retrying on the next reload: {e}")
+
+    loop_watchdog.start()
+
+    # The first attempt completes before requests are served; retries run in the background
+    warm_up_task = None
+    try:
+        await warm_up_until_ready(app, start_time, retry=False)
+    except Exception as e:
+        logging.error(f"AWS warm-up failed, worker stays unready while retrying: {e}")
+        warm_up_task = asyncio.create_task(warm_up_until_ready(app, start_time, retry=True))
+    yield
+
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await loop_watchdog.stop()
+
 # Create FastAPI app
-app = FastAPI(root_path="/api")
+app = FastAPI(root_path="/api", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -32,6 +105,9 @@ app.add_middleware(
     allow_credentials=True
 )
 
+# Request ids and on-demand profiling
+app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
+
 # OAuth2 scheme for token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -39,11 +115,15 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 LLM_GENERATE_DICT_PATH = Path(__file__).parent / "pe" / "llm_generate_dict.txt"
 PE_TEMPLATE_PATH = Path(__file__).parent / "pe" / "pe_template.txt"
 
-# Generate random 8-character password with letters and numbers
-chars = string.ascii_letters + string.digits
-RANDOM_PASSWORD = ''.join(random.choice(chars) for _ in range(8))
-logging.info(f"Generated random password for user zxxm: {RANDOM_PASSWORD}")
+# Password shared by all workers when started through serve.py, otherwise
+# generate random 8-character password with letters and numbers
+RANDOM_PASSWORD = os.environ.get("VOICESYNC_PASSWORD")
+if not RANDOM_PASSWORD:
+    chars = string.ascii_letters + string.digits
+    RANDOM_PASSWORD = ''.join(random.choice(chars) for _ in range(8))
+    logging.info(f"Generated random password for user zxxm: {RANDOM_PASSWORD}")
 
+@lru_cache(maxsize=None)
 def read_template():
     """Read the content of pe_template.txt"""
     try:
@@ -101,7 +181,7 @@ def process_json_data(json_data):
         logging.error(f"Error processing JSON data: {e}")
         raise ValueError(f"Invalid JSON format: {str(e)}")
 
-async def generate_batch_variations(session, words_batch, system_prompt, model_name):
+async def generate_batch_variations(session, words_batch, system_prompt, model_name, deadline=None):
     """Generate variations for a batch of words"""
     try:
         # Format batch as input dict
@@ -112,22 +192,46 @@ async def generate_batch_variations(session, words_batch, system_prompt, model_n
         
         # Call Bedrock service with periodic logging to keep connection alive
         logging.info(f"Starting batch generation for {len(words_batch)} words")
-        bedrock_result = await call_bedrock(batch_dict, batch_system_prompt, session, model_name)
+        bedrock_result = await call_bedrock(batch_dict, batch_system_prompt, session, model_name, deadline)
         logging.info("Batch generation completed")
         
         # Extract JSON from result
         json_result = extract_json_from_bedrock_result(bedrock_result)
         
         return json.loads(json_result)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Batch variation generation error: {e}")
         raise HTTPException(status_code=500, detail=f"Batch variation generation failed: {str(e)}")
 
+async def generate_all_variations(session, words, system_prompt, model_name, deadline):
+    """Generate variations for all words batch by batch, stopping once the deadline has passed"""
+    # Batch processing: 2-3 words per batch to control token usage
+    batch_size = 5
+    all_variations = {}
+
+    # Process words in batches with periodic logging
+    for i in range(0, len(words), batch_size):
+        words_batch = words[i:i+batch_size]
+        deadline.check(f"batch {i//batch_size + 1}")
+        logging.info(f"Processing batch {i//batch_size + 1}: {words_batch}")
+        
+        # Simulate keep-alive by logging progress
+        batch_variations = await generate_batch_variations(session, words_batch, system_prompt, model_name, deadline)
+        all_variations.update(batch_variations)
+        
+        # Optional: Add a small delay to prevent overwhelming the server
+        await asyncio.sleep(0.5)
+
+    return all_variations
+
 @app.post('/generate_variation')
-async def generate_variation(request_data: dict):
+async def generate_variation(request_data: dict, request: Request):
     try:
         # Increase timeout for long-running tasks
         logging.info("Starting variation generation")
+        deadline = get_request_deadline(request, "generate_variation")
         
         # Get JSON data from request
         json_data = request_data.get('json_data')
@@ -143,26 +247,17 @@ async def generate_variation(request_data: dict):
         logging.info(f"System prompt length: {len(system_prompt)}")
 
         # Get AWS session
-        session, _ = get_temporary_credentials()
+        session, _ = await get_session_credentials()
         
         # Call Bedrock service with Claude 3.5 Sonnet
         model_name = "claude-3-5-sonnet"
 
-        # Batch processing: 2-3 words per batch to control token usage
-        batch_size = 5
-        all_variations = {}
-
-        # Process words in batches with periodic logging
-        for i in range(0, len(words), batch_size):
-            words_batch = words[i:i+batch_size]
-            logging.info(f"Processing batch {i//batch_size + 1}: {words_batch}")
-            
-            # Simulate keep-alive by logging progress
-            batch_variations = await generate_batch_variations(session, words_batch, system_prompt, model_name)
-            all_variations.update(batch_variations)
-            
-            # Optional: Add a small delay to prevent overwhelming the server
-            await asyncio.sleep(0.5)
+        # Remaining batches are skipped if the client disconnects or the deadline expires
+        all_variations = await run_with_deadline(
+            request,
+            deadline,
+            generate_all_variations(session, words, system_prompt, model_name, deadline)
+        )
 
         # Combine variations into a single JSON
         final_json_result = json.dumps(all_variations)
@@ -195,6 +290,7 @@ async def login(credentials: dict):
     
     return {"message": "Login successful"}
 
+@lru_cache(maxsize=None)
 def read_llm_generate_dict():
     """Read the content of llm_generate_dict.txt"""
     try:
@@ -207,13 +303,79 @@ def read_llm_generate_dict():
         logging.error(f"Error reading llm_generate_dict.txt: {e}")
         raise HTTPException(status_code=500, detail="Error reading system prompt file")
 
+def require_admin(request: Request):
+    """Admin endpoints require ADMIN_TOKEN in the admin header and do not exist without it"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    provided = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    if not hmac.compare_digest(provided.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get('/admin/profiling', dependencies=[Depends(require_admin)])
+async def get_profiling_status():
+    """Shared profiler settings and stored profiles, and the event-loop watchdog state of the worker that serves this request"""
+    return {
+        "pid": os.getpid(),
+        "profiler": await asyncio.to_thread(request_profiler.status),
+        "watchdog": loop_watchdog.status()
+    }
+
+@app.post('/admin/profiling', dependencies=[Depends(require_admin)])
+async def configure_profiling(settings: dict):
+    """
+    Arm the profiler for the next N requests and/or for requests slower than a threshold,
+    and optionally change the event-loop watchdog threshold, on all workers
+    """
+    try:
+        next_requests = settings.get('next_requests')
+        latency_threshold_ms = settings.get('latency_threshold_ms')
+        sample_interval_ms = settings.get('sample_interval_ms')
+        watchdog_threshold_ms = settings.get('watchdog_threshold_ms')
+        changes = dict(
+            next_requests=int(next_requests) if next_requests is not None else None,
+            latency_threshold=float(latency_threshold_ms) / 1000 if latency_threshold_ms is not None else None,
+            sample_interval=max(0.001, float(sample_interval_ms) / 1000) if sample_interval_ms is not None else None,
+            watchdog_threshold=float(watchdog_threshold_ms) / 1000 if watchdog_threshold_ms is not None else None
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid profiling settings: {str(e)}")
+    try:
+        await asyncio.to_thread(request_profiler.configure, **changes)
+    except OSError as e:
+        logging.error(f"Error saving profiling settings: {e}")
+        raise HTTPException(status_code=500, detail="Error saving profiling settings")
+    return await get_profiling_status()
+
+@app.get('/admin/profiling/{request_id}', dependencies=[Depends(require_admin)])
+async def get_request_profile(request_id: str):
+    """Folded stacks of a profiled request, ready for flamegraph.pl or speedscope"""
+    if not is_valid_request_id(request_id):
+        raise HTTPException(status_code=400, detail="Invalid request id")
+    # Profiles are read from the shared directory, so any worker can serve them
+    try:
+        with open(request_profiler.profile_path(request_id), 'r') as f:
+            return PlainTextResponse(f.read())
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No profile for request {request_id}")
+    except OSError as e:
+        logging.error(f"Error reading profile {request_id}: {e}")
+        raise HTTPException(status_code=500, detail="Error reading profile file")
+
+@app.get('/health')
+async def health_check():
+    """Readiness probe: only succeeds once the worker has been warmed up"""
+    if not getattr(app.state, "ready", False):
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"status": "ok"}
+
 @app.get('/get_ec2_role')
 async def fetch_ec2_role():
     try:
         logging.info("Received request to fetch EC2 role")
-        role = get_ec2_role()
-        _, credentials = get_temporary_credentials()
-        region = get_aws_region()
+        # Instance metadata lookups are blocking, keep them off the event loop
+        role = await asyncio.to_thread(get_ec2_role)
+        _, credentials = await get_session_credentials()
+        region = await asyncio.to_thread(get_aws_region)
         logging.info(f"Successfully fetched EC2 role and credentials for role: {role}")
         return {
             "role": role,
@@ -237,8 +399,8 @@ async def upload_to_s3(
         logging.info(f"Received file upload request: {file.filename} to {s3_path}")
         
         # Get AWS session
-        session, _ = get_temporary_credentials()
-        s3_client = session.client('s3')
+        session, _ = await get_session_credentials()
+        s3_client = get_aws_client(session, 's3')
 
         # Upload file
         try:
@@ -277,13 +439,14 @@ async def upload_to_s3(
         raise HTTPException(status_code=500, detail="File upload failed")
 
 @app.post('/transcribe')
-async def handle_transcribe_audio(request_data: dict):
+async def handle_transcribe_audio(request_data: dict, request: Request):
     try:
+        deadline = get_request_deadline(request, "transcribe")
         logging.info("=== Transcribe Request Data ===")
         logging.info(f"Request data: {request_data}")
         
         # Get AWS session
-        session, _ = get_temporary_credentials()
+        session, _ = await get_session_credentials()
 
         # Extract required parameters
         s3_audio_url = request_data.get('s3_audio_url')
@@ -306,7 +469,11 @@ async def handle_transcribe_audio(request_data: dict):
             raise HTTPException(status_code=400, detail=error_msg)
 
         # Call transcription service
-        result = await transcribe_audio(session, s3_audio_url, system_prompt, model_name)
+        result = await run_with_deadline(
+            request,
+            deadline,
+            transcribe_audio(session, s3_audio_url, system_prompt, model_name, deadline)
+        )
         return result
 
     except HTTPException as he:
@@ -316,26 +483,40 @@ async def handle_transcribe_audio(request_data: dict):
         raise HTTPException(status_code=500, detail="Transcription process failed")
 
 @app.post('/bedrock')
-async def bedrock_inference(request_data: dict):
+async def bedrock_inference(request_data: dict, request: Request):
     try:
+        deadline = get_request_deadline(request, "bedrock")
+
         # Validate input
         transcript = request_data.get('transcript')
         system_prompt = request_data.get('system_prompt')
         model_name = request_data.get('model_name')
 
+        # Optional sharded matching for very large dictionaries
+        sharded = request_data.get('sharded', False)
+        shard_model_name = request_data.get('shard_model_name')
+        arbitrate = request_data.get('arbitrate', False)
+        if not isinstance(sharded, bool) or not isinstance(arbitrate, bool):
+            raise HTTPException(status_code=400, detail="sharded and arbitrate must be booleans")
+
         if not all([transcript, system_prompt, model_name]):
             raise HTTPException(status_code=400, detail="Missing required fields")
 
-        if model_name not in SUPPORTED_MODELS:
-            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+        for name in filter(None, [model_name, shard_model_name]):
+            if name not in model_registry:
+                raise HTTPException(status_code=400, detail=f"Unsupported model: {name}")
 
         logging.info(f"Received Bedrock inference request for model: {model_name}")
 
         # Get AWS session
-        session, _ = get_temporary_credentials()
+        session, _ = await get_session_credentials()
         
         # Call Bedrock service
-        bedrock_result = await call_bedrock(transcript, system_prompt, session, model_name)
+        if sharded:
+            work = sharded_match(transcript, system_prompt, session, model_name, shard_model_name, arbitrate, deadline)
+        else:
+            work = call_bedrock(transcript, system_prompt, session, model_name, deadline)
+        bedrock_result = await run_with_deadline(request, deadline, work)
 
         return {
             'bedrock_result': bedrock_result
@@ -347,6 +528,49 @@ async def bedrock_inference(request_data: dict):
         logging.error(f"Bedrock inference error: {e}")
         raise HTTPException(status_code=500, detail="Bedrock inference failed")
 
+@app.post('/bedrock/batch')
+async def bedrock_batch_inference(request_data: dict, request: Request):
+    try:
+        deadline = get_request_deadline(request, "bedrock_batch")
+
+        # Validate input
+        transcripts = request_data.get('transcripts')
+        system_prompt = request_data.get('system_prompt')
+        model_name = request_data.get('model_name')
+
+        if not all([transcripts, system_prompt, model_name]):
+            raise HTTPException(status_code=400, detail="Missing required fields")
+
+        if not isinstance(transcripts, list) or not all(isinstance(t, str) and t for t in transcripts):
+            raise HTTPException(status_code=400, detail="transcripts must be a list of non-empty strings")
+
+        if len(transcripts) > MAX_BATCH_TRANSCRIPTS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TRANSCRIPTS} transcripts per request")
+
+        if model_name not in model_registry:
+            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+
+        logging.info(f"Received Bedrock batch inference request for {len(transcripts)} transcripts, model: {model_name}")
+
+        # Get AWS session
+        session, _ = await get_session_credentials()
+
+        results = await run_with_deadline(
+            request,
+            deadline,
+            batch_match(transcripts, system_prompt, session, model_name, deadline)
+        )
+
+        return {
+            'results': results
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logging.error(f"Bedrock batch inference error: {e}")
+        raise HTTPException(status_code=500, detail="Bedrock batch inference failed")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,37 @@
+import logging
+import os
+import random
+import string
+import uvicorn
+
+# Production server settings
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+def main():
+    """
+    Run the backend with several workers and no reloader.
+
+    The login password is generated here once and handed to every worker through
+    the environment, so that all workers accept the same credentials.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    if not os.environ.get("VOICESYNC_PASSWORD"):
+        chars = string.ascii_letters + string.digits
+        os.environ["VOICESYNC_PASSWORD"] = ''.join(random.choice(chars) for _ in range(8))
+    logging.info(f"Generated random password for user zxxm: {os.environ['VOICESYNC_PASSWORD']}")
+
+    logging.info(f"Starting {WORKERS} workers on {HOST}:{PORT}")
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        reload=False,
+        timeout_graceful_shutdown=30
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
 import logging
+import asyncio
+import threading
 import requests
 import json
-import boto3
 from fastapi import HTTPException
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from dateutil import parser
-from .config import DEFAULT_AWS_REGION, METADATA_SERVICE_URL
+from .config import DEFAULT_AWS_REGION, METADATA_SERVICE_URL, AWS_CONNECT_TIMEOUT, AWS_CLIENT_SETTINGS, CREDENTIALS_REFRESH_MARGIN, CREDENTIALS_MIN_VALIDITY
+
+# Process-wide cache of the current session, its credentials and the clients built from it.
+# boto3 itself is imported lazily on the first credential fetch.
+_session = None
+_credentials = None
+_clients = {}
+_lock = threading.Lock()
+# Serializes credential refreshes; never held together with _lock across network calls
+_refresh_lock = threading.Lock()
 
 def get_imdsv2_token():
     """
@@ -79,39 +89,154 @@ def get_ec2_role():
         logging.error(f"Unexpected error fetching EC2 role: {e}")
         raise HTTPException(status_code=500, detail=f"Unexpected error fetching EC2 role: {str(e)}")
 
-def get_temporary_credentials():
+def _credentials_state():
     """
-    Retrieve temporary AWS credentials
+    State of the cached credentials: "fresh", "stale" (inside the refresh margin but still
+    usable) or "expired" (missing, unparseable or about to expire). Caller holds _lock.
     """
-    session = None
-    credentials = None
+    if _session is None or _credentials is None or 'Expiration' not in _credentials:
+        return "expired"
+    try:
+        expiration = parser.parse(_credentials['Expiration'])
+    except (ValueError, TypeError) as e:
+        logging.error(f"Error parsing expiration time: {e}")
+        return "expired"
     current_time = datetime.now(timezone.utc)
-    needs_refresh = True
+    if expiration - timedelta(seconds=CREDENTIALS_REFRESH_MARGIN) > current_time:
+        return "fresh"
+    if expiration - timedelta(seconds=CREDENTIALS_MIN_VALIDITY) > current_time:
+        return "stale"
+    return "expired"
 
-    if session is not None and credentials is not None and 'Expiration' in credentials:
-        try:
-            expiration = parser.parse(credentials['Expiration'])
-            needs_refresh = expiration <= current_time
-        except (ValueError, TypeError) as e:
-            logging.error(f"Error parsing expiration time: {e}")
-            needs_refresh = True
-
-    if needs_refresh:
-        role = get_ec2_role()
+def _fetch_session():
+    """
+    Fetch the instance role's temporary credentials and build a session from them
+    """
+    import boto3
+
+    role = get_ec2_role()
+    try:
+        logging.info(f"Attempting to fetch temporary credentials for role: {role}")
+        creds_json = get_instance_metadata(f"iam/security-credentials/{role}")
+        credentials = json.loads(creds_json)
+        session = boto3.Session(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['Token']
+        )
+        logging.info("Successfully fetched temporary credentials")
+        return session, credentials
+    except json.JSONDecodeError as e:
+        logging.error(f"Error parsing temporary credentials: {e}")
+        raise HTTPException(status_code=500, detail="Failed to parse temporary credentials")
+    except Exception as e:
+        logging.error(f"Error fetching temporary credentials: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch temporary credentials: {str(e)}")
+
+def refresh_credentials():
+    """
+    Fetch new credentials and swap them in, together with new clients for the services in use.
+
+    Only one refresh runs at a time. The network calls and client creation happen
+    without holding _lock, so callers reading the cache are never blocked by them.
+    """
+    global _session, _credentials, _clients
+    with _refresh_lock:
+        with _lock:
+            if _credentials_state() == "fresh":
+                return _session, _credentials
+            service_names = list(_clients)
+        session, credentials = _fetch_session()
+        clients = {name: (session, _create_client(session, name)) for name in service_names}
+        with _lock:
+            _session, _credentials, _clients = session, credentials, clients
+        return session, credentials
+
+def get_temporary_credentials():
+    """
+    Retrieve temporary AWS credentials, reusing the cached session until it is close to expiry.
+
+    Blocks while credentials are refreshed; request handlers use get_session_credentials().
+    """
+    with _lock:
+        if _credentials_state() == "fresh":
+            return _session, _credentials
+    return refresh_credentials()
+
+def _refresh_in_background():
+    try:
+        refresh_credentials()
+    except HTTPException as e:
+        logging.error(f"Background credential refresh failed: {e.detail}")
+
+async def get_session_credentials():
+    """
+    Cached session and credentials for request handlers, without blocking the event loop.
+
+    Inside CREDENTIALS_REFRESH_MARGIN the cached credentials are returned while a refresh
+    runs in a background thread; only missing or expiring credentials are waited for,
+    in a worker thread.
+    """
+    with _lock:
+        state = _credentials_state()
+        cached = (_session, _credentials)
+    if state == "fresh":
+        return cached
+    if state == "stale":
+        if not _refresh_lock.locked():
+            threading.Thread(target=_refresh_in_background, name="credentials-refresh", daemon=True).start()
+        return cached
+    return await asyncio.to_thread(get_temporary_credentials)
+
+def _create_client(session, service_name: str):
+    from botocore.config import Config
+
+    settings = AWS_CLIENT_SETTINGS.get(service_name, {})
+    client = session.client(service_name, config=Config(
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=settings.get('read_timeout', 60),
+        retries={'max_attempts': settings.get('max_attempts', 3), 'mode': 'standard'},
+        max_pool_connections=settings.get('max_pool_connections', 10)
+    ))
+    logging.info(f"Created {service_name} client")
+    return client
+
+def get_aws_client(session, service_name: str):
+    """
+    Return a client for the given service, created once per session.
+
+    Clients are thread-safe and keep their connection pool, so reusing them avoids
+    reloading the service model and repeating TLS handshakes on every request.
+    """
+    with _lock:
+        cached = _clients.get(service_name)
+        # Callers still holding a session replaced by a refresh get the current client
+        if cached is not None and (cached[0] is session or cached[0] is _session):
+            return cached[1]
+    client = _create_client(session, service_name)
+    with _lock:
+        cached = _clients.get(service_name)
+        if cached is None or cached[0] is not _session:
+            _clients[service_name] = (session, client)
+    return client
+
+# Cheap read-only calls used to open a pooled TLS connection to each service.
+# Access-denied responses are fine: the connection is still established and kept.
+WARMUP_CALLS = {
+    'bedrock-runtime': ('list_async_invokes', {'maxResults': 1}),
+    'transcribe': ('list_transcription_jobs', {'MaxResults': 1}),
+    's3': ('list_buckets', {}),
+}
+
+def warm_up_aws():
+    """
+    Pre-load credentials and clients and open warm connections to Bedrock, Transcribe and S3
+    """
+    session, _ = get_temporary_credentials()
+    for service_name, (operation, params) in WARMUP_CALLS.items():
+        client = get_aws_client(session, service_name)
         try:
-            logging.info(f"Attempting to fetch temporary credentials for role: {role}")
-            creds_json = get_instance_metadata(f"iam/security-credentials/{role}")
-            credentials = json.loads(creds_json)
-            session = boto3.Session(
-                aws_access_key_id=credentials['AccessKeyId'],
-                aws_secret_access_key=credentials['SecretAccessKey'],
-                aws_session_token=credentials['Token']
-            )
-            logging.info("Successfully fetched temporary credentials")
-        except json.JSONDecodeError as e:
-            logging.error(f"Error parsing temporary credentials: {e}")
-            raise HTTPException(status_code=500, detail="Failed to parse temporary credentials")
+            getattr(client, operation)(**params)
+            logging.info(f"Warmed up connection to {service_name}")
         except Exception as e:
-            logging.error(f"Error fetching temporary credentials: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to fetch temporary credentials: {str(e)}")
-    return session, credentials
+            logging.info(f"Warm-up call {service_name}.{operation} returned: {e}")
@@ -0,0 +1,166 @@
+import logging
+import json
+import asyncio
+from html import escape
+from fastapi import HTTPException
+from .config import BATCH_TOKEN_BUDGET, MAX_BATCH_ITEMS, BATCH_OUTPUT_TOKENS_PER_ITEM, MAX_CONCURRENT_BATCHES
+from .model_registry import model_registry
+from .bedrock_service import call_bedrock, converse, response_text, split_system_prompt
+from .sharded_matching import estimate_tokens, parse_match_result, format_match_result, split_dictionary, normalize_keyword
+
+BATCH_INSTRUCTIONS = """
+
+Batch Mode:
+You will receive several texts, each wrapped as <text id="N">...</text>. Match every text independently against the dictionary using the strategy above.
+Respond only with a JSON array containing one object per text, in any order, without any other words:
+[{"id": N, "matched_word": "<dictionary keyword or null>", "match_type": "<Exact/Partial/Phonetic or null>", "confidence": "<High/Medium/Low or null>"}]
+Use null for matched_word when no match is found."""
+
+def pack_transcripts(transcripts, max_items: int, token_budget: int = BATCH_TOKEN_BUDGET):
+    """
+    Group transcript indexes into packs bounded by input tokens and item count
+    """
+    packs = []
+    current, current_tokens = [], 0
+    for index, transcript in enumerate(transcripts):
+        tokens = estimate_tokens(transcript) + 8  # <text id="N"> wrapper
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_items):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+def find_json_array(result: str):
+    """
+    Decode the first JSON array of objects in a model answer, skipping other bracketed text
+    """
+    decoder = json.JSONDecoder()
+    start = result.find("[")
+    while start != -1:
+        try:
+            value, _ = decoder.raw_decode(result, start)
+            if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+                return value
+        except ValueError:
+            pass
+        start = result.find("[", start + 1)
+    raise ValueError("No JSON array found in batch result")
+
+def parse_batch_result(result: str, keywords=None):
+    """
+    Parse the JSON array answer of a batch call into a dict keyed by item id.
+
+    With `keywords` (normalized keyword -> dictionary keyword), matched words are
+    mapped back to the dictionary's spelling; items naming a word that is not in
+    the dictionary are left out, so that they are retried.
+    """
+    items = {}
+    for item in find_json_array(result):
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            continue
+        if item.get("matched_word"):
+            word = str(item["matched_word"])
+            if keywords is not None:
+                word = keywords.get(normalize_keyword(word))
+                if word is None:
+                    logging.warning(f"Batch answer {item['matched_word']} is not a dictionary keyword, retrying item")
+                    continue
+            items[item["id"]] = {
+                "word": word,
+                "match_type": str(item.get("match_type") or ""),
+                "confidence": str(item.get("confidence") or ""),
+            }
+        else:
+            items[item["id"]] = None
+    return items
+
+def item_result(index, transcript, match):
+    return {
+        "index": index,
+        "transcript": transcript,
+        "matched_word": match["word"] if match else None,
+        "match_type": match["match_type"] if match else None,
+        "confidence": match["confidence"] if match else None,
+        "bedrock_result": format_match_result(match),
+    }
+
+async def batch_match(transcripts, system_prompt: str, session, model_name: str, deadline=None):
+    """
+    Match many transcripts against the same dictionary, packing several into each call.
+
+    The dictionary is sent once per pack instead of once per transcript. Packs run
+    concurrently and results are returned in input order. Matched words are mapped
+    back to the dictionary's keywords. Items missing from a pack's answer or naming
+    an unknown keyword, and whole packs whose answer cannot be parsed, are retried
+    one transcript at a time through call_bedrock. A failed call fails the whole batch
+    and cancels the packs still in flight.
+    """
+    model = model_registry.get(model_name)
+    if model is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+    max_items = MAX_BATCH_ITEMS
+    if model.max_tokens:
+        max_items = max(1, min(MAX_BATCH_ITEMS, model.max_tokens // BATCH_OUTPUT_TOKENS_PER_ITEM))
+
+    dictionary_data, base_system_prompt = split_system_prompt(system_prompt)
+    parts = split_dictionary(system_prompt)
+    keywords = {normalize_keyword(keyword): keyword for keyword in parts[1]} if parts else None
+    batch_system_prompt = base_system_prompt + BATCH_INSTRUCTIONS
+    packs = pack_transcripts(transcripts, max_items)
+    logging.info(f"Batch matching {len(transcripts)} transcripts in {len(packs)} packs of up to {max_items} items")
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    results = [None] * len(transcripts)
+
+    async def match_single(index):
+        result = await call_bedrock(transcripts[index], system_prompt, session, model_name, deadline)
+        match = parse_match_result(result)
+        if match is not None and keywords is not None:
+            keyword = keywords.get(normalize_keyword(match["word"]))
+            if keyword is None:
+                logging.warning(f"Answer {match['word']} is not a dictionary keyword, treating as no match")
+                match = None
+            else:
+                match["word"] = keyword
+        results[index] = item_result(index, transcripts[index], match)
+
+    async def match_pack(pack):
+        user_input = dictionary_data + "".join(
+            f'<text id="{index}">{escape(transcripts[index], quote=False)}</text>' for index in pack
+        )
+        try:
+            async with semaphore:
+                response = await converse(session, model_name, batch_system_prompt, user_input, deadline)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logging.error(f"Batch call failed: {e}")
+            raise HTTPException(status_code=500, detail=f"Batch call failed: {e}")
+        # Only an unusable answer is worth retrying item by item; failed calls (e.g. throttling) are not
+        try:
+            answers = parse_batch_result(response_text(response), keywords)
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            logging.warning(f"Batch answer could not be parsed, retrying {len(pack)} items individually: {e}")
+            answers = {}
+
+        missing = [index for index in pack if index not in answers]
+        for index in pack:
+            if index in answers:
+                results[index] = item_result(index, transcripts[index], answers[index])
+        if missing:
+            logging.warning(f"{len(missing)} items missing from batch answer, retrying individually")
+            for index in missing:
+                async with semaphore:
+                    await match_single(index)
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            for pack in packs:
+                group.create_task(match_pack(pack))
+    except ExceptionGroup as e:
+        # The remaining packs have been cancelled, report the first failure
+        raise e.exceptions[0]
+    return results
@@ -1,51 +1,26 @@
 import logging
 import time
-import json
-import boto3
 from fastapi import HTTPException
-from .config import SUPPORTED_MODELS
+from .model_registry import model_registry
 from .logging_utils import log_execution_time
+from .aws_utils import get_aws_client
+from .deadline_utils import Deadline, run_blocking
 
-def generate_conversation(
-    bedrock_client, 
-    model_id, 
-    system_prompts, 
-    messages, 
-    inference_config, 
-    additional_model_request_fields=None,
-    performanceConfig=None):
+def generate_conversation(bedrock_client, request_params):
     """
     Sends messages to a model using the Bedrock Converse API.
     
     Parameters:
         bedrock_client: The Bedrock client used to interact with the API.
-        model_id: The ID of the model to use.
-        system_prompts: System prompts to pass to the model.
-        messages: User messages for the conversation.
-        inference_config: Configuration for model inference (e.g., temperature, max tokens).
-        additional_model_request_fields: (Optional) Additional fields for specific models.
+        request_params: Complete Converse request (model ID, system prompts, messages,
+            inference config and any model-specific fields).
     """
+    model_id = request_params['modelId']
     logging.info(f"Generating message with model {model_id}")
 
     try:
         start_time = time.time()
 
-        # 构建基本请求参数
-        request_params = {
-            'modelId': model_id,
-            'messages': messages,
-            'system': system_prompts,
-            'inferenceConfig': inference_config
-        }
-
-        # 如果有额外的请求字段，添加到请求参数中
-        if additional_model_request_fields:
-            request_params['additionalModelRequestFields'] = additional_model_request_fields
-
-        if performanceConfig:
-            request_params['performanceConfig'] = performanceConfig
-
-
         # 执行单次调用
         response = bedrock_client.converse(**request_params)
 
@@ -68,63 +43,74 @@ def generate_conversation(
         logging.error(f"Error generating conversation: {e}")
         raise
 
-async def call_bedrock(transcript: str, system_prompt: str, session: boto3.Session, model_name: str):
+def split_system_prompt(system_prompt: str):
+    """
+    Split the <dictionary> section out of a system prompt.
+
+    Returns (dictionary_data, remaining_system_prompt); dictionary_data is empty
+    when the prompt has no <dictionary> section.
+    """
+    start_index = system_prompt.find("<dictionary>")
+    end_index = system_prompt.find("</dictionary>")
+    if start_index == -1 or end_index == -1:
+        return "", system_prompt
+    end_index += len("</dictionary>")
+    return system_prompt[start_index:end_index], system_prompt[:start_index] + system_prompt[end_index:]
+
+async def converse(session: "boto3.Session", model_name: str, system_prompt: str, user_input: str, deadline: Deadline = None):
+    """
+    Send one system prompt and user message to a configured model and return the raw Converse response
+
+    The Converse call runs in a worker thread so that it can be abandoned when the
+    deadline expires or the request is cancelled.
+    """
+    # Initialize Bedrock runtime client
+    bedrock_runtime = get_aws_client(session, 'bedrock-runtime')
+
+    model = model_registry.get(model_name)
+    if model is None:
+        raise ValueError(f"Unsupported model: {model_name}")
+
+    # Prepare system prompts and messages
+    system_prompts = [{"text": system_prompt}]
+    messages = [{
+        "role": "user",
+        "content": [{"text": user_input}]
+    }]
+
+    # Generate conversation using the Converse API
+    return await run_blocking(
+        deadline,
+        "Bedrock inference",
+        generate_conversation,
+        bedrock_runtime,
+        model.converse_request(system_prompts, messages)
+    )
+
+def response_text(response) -> str:
+    """Extract the model's text answer from a Converse response"""
+    output_message = response['output']['message']
+    return output_message['content'][0]['text']
+
+async def call_bedrock(transcript: str, system_prompt: str, session: "boto3.Session", model_name: str, deadline: Deadline = None):
     """
     Call Bedrock API with given transcript and system prompt
     """
     try:
-        # Initialize Bedrock runtime client
-        bedrock_runtime = session.client('bedrock-runtime')
-
-        # Print SUPPORTED_MODELS for debugging
-        logging.info("=== SUPPORTED_MODELS Content ===")
-        logging.info(f"Type of SUPPORTED_MODELS: {type(SUPPORTED_MODELS)}")
-        logging.info(f"Content of SUPPORTED_MODELS: {json.dumps(SUPPORTED_MODELS, indent=2)}")
-        logging.info("==============================")
-
-        if model_name not in SUPPORTED_MODELS:
-            raise ValueError(f"Unsupported model: {model_name}")
-
-        model_info = SUPPORTED_MODELS[model_name]
-        model_id = model_info["id"]
-        inference_config = model_info["config"]
-        additional_request_fields = inference_config.pop("additionalModelRequestFields", None)
-        performanceConfig = inference_config.pop("performanceConfig", None)
-
-        # Extract dictionary from system_prompt
-        start_index = system_prompt.find("<dictionary>")
-        end_index = system_prompt.find("</dictionary>") + len("</dictionary>")
-        dictionary_data = system_prompt[start_index:end_index]
-
-        user_input = dictionary_data+ "<text>" + transcript + "</text>"
-        # Remove dictionary part from system_prompt
-        new_system_prompt = system_prompt[:start_index] + system_prompt[end_index:]
-
-        # Prepare system prompts and messages
-        system_prompts = [{"text": new_system_prompt}]
-        messages = [{
-            "role": "user",
-            "content": [{"text": user_input}]
-        }]
-
-        # Generate conversation using the Converse API
-        response = generate_conversation(
-            bedrock_runtime,
-            model_id,
-            system_prompts,
-            messages,
-            inference_config,
-            additional_request_fields,
-            performanceConfig
-        )
+        # Move the dictionary from the system prompt into the user input
+        dictionary_data, new_system_prompt = split_system_prompt(system_prompt)
+        user_input = dictionary_data + "<text>" + transcript + "</text>"
+
+        response = await converse(session, model_name, new_system_prompt, user_input, deadline)
 
         # Extract the model's response
-        output_message = response['output']['message']
-        result = output_message['content'][0]['text']
+        result = response_text(response)
         logging.info(f"Bedrock {model_name} result: {result}")
 
         return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error calling Bedrock API: {e}")
         raise HTTPException(status_code=500, detail=f"Bedrock API call failed: {str(e)}")
@@ -1,24 +1,10 @@
 import os
-import json
 
 # In Docker environment, the config file is mounted at /app/shared/config/models_config.json
-MODELS_CONFIG_PATH = '/app/shared/config/models_config.json'
-
-# Load models configuration from the shared JSON file
-def load_models_config():
-    try:
-        with open(MODELS_CONFIG_PATH, 'r') as f:
-            config = json.load(f)
-            return config.get('supported_models', {})
-    except FileNotFoundError:
-        print(f"Warning: Models configuration file not found at {MODELS_CONFIG_PATH}")
-        return {}
-    except json.JSONDecodeError:
-        print(f"Error: Invalid JSON in models configuration file at {MODELS_CONFIG_PATH}")
-        return {}
-
-# Define supported models dynamically from the configuration file
-SUPPORTED_MODELS = load_models_config()
+MODELS_CONFIG_PATH = os.environ.get('MODELS_CONFIG_PATH', '/app/shared/config/models_config.json')
+
+# How often (seconds) the models configuration file is checked for changes
+MODELS_CONFIG_RELOAD_INTERVAL = 5
 
 # Logging configurations
 LOG_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -28,3 +14,58 @@ EXECUTION_TIMES_LOG_FILE = os.path.join(LOG_DIR, 'execution_times.log')
 # AWS Configurations
 DEFAULT_AWS_REGION = "us-west-2"
 METADATA_SERVICE_URL = "http://169.254.169.254/latest"
+
+# Request deadline configurations (seconds)
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+MAX_REQUEST_TIMEOUT = 900
+DEFAULT_REQUEST_TIMEOUTS = {
+    "transcribe": 300,
+    "generate_variation": 600,
+    "bedrock": 60,
+    "bedrock_batch": 300,
+}
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Upstream AWS client settings (timeouts in seconds)
+AWS_CONNECT_TIMEOUT = 5
+# Bedrock reads are kept within the shortest endpoint deadline (/bedrock, 60s); retries
+# for throttling are kept, the request deadline bounds how long a caller waits for them
+AWS_CLIENT_SETTINGS = {
+    "bedrock-runtime": {"read_timeout": 55, "max_attempts": 3, "max_pool_connections": 50},
+    "transcribe": {"read_timeout": 10, "max_attempts": 3},
+    "s3": {"read_timeout": 60, "max_attempts": 3},
+}
+TRANSCRIPT_FETCH_TIMEOUT = 10
+# Credentials are refreshed in the background once they expire within the margin, and
+# requests only wait for a refresh when less than the minimum validity is left
+CREDENTIALS_REFRESH_MARGIN = 300
+CREDENTIALS_MIN_VALIDITY = 60
+
+# Worker warm-up: readiness waits for AWS unless WARMUP_OPTIONAL is set (local development)
+WARMUP_OPTIONAL = os.environ.get('WARMUP_OPTIONAL', '').lower() in ('1', 'true', 'yes')
+WARMUP_RETRY_INTERVAL = 5
+
+# Sharded matching for large dictionaries
+SHARD_TOKEN_BUDGET = 2000
+MAX_CONCURRENT_SHARDS = 8
+
+# Multi-utterance batched matching
+BATCH_TOKEN_BUDGET = 1500
+MAX_BATCH_ITEMS = 25
+BATCH_OUTPUT_TOKENS_PER_ITEM = 40
+MAX_CONCURRENT_BATCHES = 4
+MAX_BATCH_TRANSCRIPTS = 500
+
+# Profiling and event-loop watchdog
+PROFILE_DIR = os.path.join(LOG_DIR, 'profiles')
+MAX_STORED_PROFILES = 100
+PROFILE_SAMPLE_INTERVAL = 0.01
+# Arm state shared by all workers, re-read by each worker at most every check interval
+PROFILE_STATE_FILE = 'profiling.state'
+PROFILE_STATE_CHECK_INTERVAL = 0.5
+LOOP_LAG_CHECK_INTERVAL = 0.05
+LOOP_LAG_THRESHOLD = 0.2
+REQUEST_ID_HEADER = "X-Request-ID"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
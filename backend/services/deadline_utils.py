@@ -0,0 +1,116 @@
+import logging
+import math
+import time
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, Request
+from .config import (
+    REQUEST_TIMEOUT_HEADER,
+    MAX_REQUEST_TIMEOUT,
+    DEFAULT_REQUEST_TIMEOUTS,
+    DISCONNECT_POLL_INTERVAL,
+    AWS_CLIENT_SETTINGS,
+)
+
+# Dedicated pool for blocking upstream calls, sized to the Bedrock connection pool so
+# that abandoned calls cannot starve the default executor or cap shard/batch concurrency
+BLOCKING_EXECUTOR = ThreadPoolExecutor(
+    max_workers=AWS_CLIENT_SETTINGS["bedrock-runtime"]["max_pool_connections"],
+    thread_name_prefix="upstream-call"
+)
+
+# Non-standard status used when the client went away before we answered
+CLIENT_CLOSED_REQUEST = 499
+
+class Deadline:
+    """
+    Absolute point in time by which a request must be finished
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str = "request"):
+        """
+        Raise a 504 if the deadline has passed
+        """
+        if self.expired():
+            logging.warning(f"Deadline of {self.timeout:.1f}s exceeded during {stage}")
+            raise HTTPException(status_code=504, detail=f"Deadline exceeded during {stage}")
+
+def get_request_deadline(request: Request, endpoint: str) -> Deadline:
+    """
+    Build the deadline for a request from the timeout header or the endpoint default
+    """
+    timeout = DEFAULT_REQUEST_TIMEOUTS[endpoint]
+    header_value = request.headers.get(REQUEST_TIMEOUT_HEADER)
+    if header_value:
+        try:
+            timeout = float(header_value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid {REQUEST_TIMEOUT_HEADER} header: {header_value}")
+        if not math.isfinite(timeout) or timeout <= 0:
+            raise HTTPException(status_code=400, detail=f"{REQUEST_TIMEOUT_HEADER} must be a positive number")
+        timeout = min(timeout, MAX_REQUEST_TIMEOUT)
+    logging.info(f"Request deadline for {endpoint}: {timeout:.1f}s")
+    return Deadline(timeout)
+
+async def run_with_deadline(request: Request, deadline: Deadline, coro):
+    """
+    Run a coroutine until it finishes, the deadline expires or the client disconnects.
+
+    In the latter two cases the work is cancelled so that cleanup handlers in the
+    services (e.g. deleting a transcription job) run before we answer.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_INTERVAL, deadline.remaining()))
+            if task in done:
+                return task.result()
+            if deadline.expired():
+                logging.warning(f"Deadline of {deadline.timeout:.1f}s exceeded, cancelling in-flight work")
+                raise HTTPException(status_code=504, detail="Request deadline exceeded")
+            if await request.is_disconnected():
+                logging.warning("Client disconnected, cancelling in-flight work")
+                raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logging.warning(f"Error while cancelling in-flight work: {e}")
+
+async def run_blocking(deadline: Deadline, stage: str, func, *args, **kwargs):
+    """
+    Run a blocking call in a worker thread, bounded by the remaining deadline.
+
+    The thread cannot be interrupted, but the awaiting request stops waiting for it
+    as soon as the deadline passes or the request is cancelled.
+    """
+    if deadline is not None:
+        deadline.check(stage)
+    # Like asyncio.to_thread, carry the caller's context variables into the worker thread
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    future = asyncio.get_running_loop().run_in_executor(BLOCKING_EXECUTOR, call)
+    if deadline is None:
+        return await future
+    try:
+        return await asyncio.wait_for(future, timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        logging.warning(f"Deadline of {deadline.timeout:.1f}s exceeded during {stage}")
+        raise HTTPException(status_code=504, detail=f"Deadline exceeded during {stage}")
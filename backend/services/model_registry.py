@@ -0,0 +1,166 @@
+import logging
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from .config import MODELS_CONFIG_PATH, MODELS_CONFIG_RELOAD_INTERVAL
+
+INFERENCE_CONFIG_KEYS = {"maxTokens", "temperature", "topP", "stopSequences"}
+LATENCY_MODES = {"standard", "optimized"}
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    Validated, precompiled Converse request template for one configured model
+    """
+    name: str
+    display_name: str
+    model_id: str
+    request_template: MappingProxyType
+
+    @property
+    def max_tokens(self):
+        """Configured output token limit, or None if the model default applies"""
+        return self.request_template['inferenceConfig'].get('maxTokens')
+
+    def converse_request(self, system_prompts, messages):
+        """
+        Build the Converse request parameters for a single call.
+
+        The template is read-only at the top level and shared between requests. Each
+        call gets its own request dict with copies of the top-level sections (such as
+        inferenceConfig), so adjusting them cannot leak into later requests; values
+        nested deeper are shared and must not be modified.
+        """
+        request_params = {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in self.request_template.items()
+        }
+        request_params['system'] = system_prompts
+        request_params['messages'] = messages
+        return request_params
+
+def compile_model(name, model_info):
+    """
+    Validate one entry of models_config.json and precompile its request template.
+
+    `additionalModelRequestFields` and `performanceConfig` are accepted either next
+    to `config` or, as in older config files, nested inside it.
+    """
+    if not isinstance(model_info, dict):
+        raise ValueError("model entry must be an object")
+    model_id = model_info.get("id")
+    if not isinstance(model_id, str) or not model_id:
+        raise ValueError("missing model id")
+
+    config = model_info.get("config") or {}
+    if not isinstance(config, dict):
+        raise ValueError("config must be an object")
+    inference_config = dict(config)
+    nested_additional_fields = inference_config.pop("additionalModelRequestFields", None)
+    nested_performance_config = inference_config.pop("performanceConfig", None)
+    additional_fields = model_info.get("additionalModelRequestFields", nested_additional_fields)
+    performance_config = model_info.get("performanceConfig", nested_performance_config)
+
+    unknown_keys = set(inference_config) - INFERENCE_CONFIG_KEYS
+    if unknown_keys:
+        raise ValueError(f"unknown inference config keys: {', '.join(sorted(unknown_keys))}")
+    if additional_fields is not None and not isinstance(additional_fields, dict):
+        raise ValueError("additionalModelRequestFields must be an object")
+    if performance_config is not None:
+        latency = performance_config.get("latency") if isinstance(performance_config, dict) else None
+        if not isinstance(latency, str) or latency not in LATENCY_MODES:
+            raise ValueError(f"performanceConfig.latency must be one of: {', '.join(sorted(LATENCY_MODES))}")
+
+    request_template = {
+        'modelId': model_id,
+        'inferenceConfig': inference_config,
+    }
+    if additional_fields:
+        request_template['additionalModelRequestFields'] = additional_fields
+    if performance_config:
+        request_template['performanceConfig'] = performance_config
+
+    return ModelSpec(
+        name=name,
+        display_name=model_info.get("display_name", name),
+        model_id=model_id,
+        request_template=MappingProxyType(request_template)
+    )
+
+class ModelRegistry:
+    """
+    Read-only view of models_config.json that reloads itself when the file changes.
+
+    The file is checked at most once every `reload_interval` seconds on access. A
+    config that fails to parse keeps the previous models; invalid entries are skipped.
+    """
+
+    def __init__(self, path, reload_interval):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._models = MappingProxyType({})
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self):
+        """
+        Load the config file if it changed since the last load, returning True if it did
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                if self._mtime is not False:
+                    logging.warning(f"Models configuration file not found at {self.path}")
+                self._mtime = False
+                return False
+            if mtime == self._mtime:
+                return False
+
+            try:
+                with open(self.path, 'r') as f:
+                    config = json.load(f)
+                if not isinstance(config, dict):
+                    raise ValueError("top level must be an object")
+                supported_models = config.get('supported_models', {})
+                if not isinstance(supported_models, dict):
+                    raise ValueError("supported_models must be an object")
+            except (OSError, ValueError) as e:
+                logging.error(f"Invalid models configuration file at {self.path}, keeping previous models: {e}")
+                self._mtime = mtime
+                return False
+
+            models = {}
+            for name, model_info in supported_models.items():
+                try:
+                    models[name] = compile_model(name, model_info)
+                except (ValueError, TypeError) as e:
+                    logging.error(f"Skipping invalid model {name}: {e}")
+
+            self._models = MappingProxyType(models)
+            self._mtime = mtime
+            logging.info(f"Loaded {len(models)} models from {self.path}: {', '.join(models)}")
+            return True
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+
+    def get(self, name):
+        """Return the ModelSpec for a model name, or None if it is not configured"""
+        self._maybe_reload()
+        return self._models.get(name)
+
+    def names(self):
+        self._maybe_reload()
+        return list(self._models)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+model_registry = ModelRegistry(MODELS_CONFIG_PATH, MODELS_CONFIG_RELOAD_INTERVAL)
@@ -0,0 +1,405 @@
+import logging
+import os
+import sys
+import json
+import fcntl
+import time
+import uuid
+import asyncio
+import threading
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from .config import (
+    PROFILE_DIR,
+    MAX_STORED_PROFILES,
+    PROFILE_SAMPLE_INTERVAL,
+    PROFILE_STATE_FILE,
+    PROFILE_STATE_CHECK_INTERVAL,
+    LOOP_LAG_CHECK_INTERVAL,
+    LOOP_LAG_THRESHOLD,
+    REQUEST_ID_HEADER,
+)
+
+# Probes and the profiling endpoints themselves are never profiled
+UNPROFILED_PATHS = ("/health", "/admin")
+
+def is_valid_request_id(request_id):
+    """The id becomes a file name, so only short alphanumeric ids (dashes allowed) are accepted"""
+    return bool(request_id) and len(request_id) <= 64 and request_id.replace("-", "").isalnum()
+
+# Innermost frames of threads parked waiting for work: executor workers, AnyIO
+# workers, the event loop waiting in select() and uvicorn's worker health pipe
+IDLE_STACKS = (
+    (("thread.py", "_worker"),),
+    (("selectors.py", "select"),),
+    (("threading.py", "wait"), ("queue.py", "get"), ("_asyncio.py", "run")),
+    (("connection.py", "_recv"), ("connection.py", "_recv_bytes"), ("connection.py", "recv"), ("multiprocess.py", "pong")),
+)
+IDLE_STACK_DEPTH = max(len(pattern) for pattern in IDLE_STACKS)
+
+def is_idle(frame):
+    """True if the thread's innermost frames show it parked waiting for work"""
+    innermost = []
+    while frame is not None and len(innermost) < IDLE_STACK_DEPTH:
+        innermost.append((os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    return any(tuple(innermost[:len(pattern)]) == pattern for pattern in IDLE_STACKS)
+
+def fold_stack(frame, thread_name):
+    """
+    Render a frame and its callers as one folded-stack line (root first), as used by flamegraph tools
+    """
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+class LoopLagWatchdog:
+    """
+    Detect event-loop stalls and log the stack of whatever is blocking the loop.
+
+    A heartbeat task on the loop records when it last ran; a separate thread checks
+    the heartbeat and, once the loop has been stuck for longer than the threshold,
+    dumps the loop thread's current stack while it is still blocked.
+    """
+
+    def __init__(self, threshold=LOOP_LAG_THRESHOLD, interval=LOOP_LAG_CHECK_INTERVAL, state=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.state = state
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logging.info(f"Event-loop watchdog started (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_lag = max(0.0, now - expected)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._last_beat = now
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stop.wait(self.interval):
+            # A threshold set through the admin endpoint applies to every worker
+            shared_threshold = self.state.current()["watchdog_threshold"] if self.state is not None else None
+            if shared_threshold is not None:
+                self.threshold = shared_threshold
+            blocked_for = time.monotonic() - self._last_beat - self.interval
+            if blocked_for > self.threshold and stalled_since is None:
+                stalled_since = self._last_beat
+                self.stalls += 1
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+                logging.warning(f"Event loop blocked for {blocked_for * 1000:.0f} ms, current stack:\n{stack}")
+            elif stalled_since is not None and self._last_beat > stalled_since:
+                logging.warning(f"Event loop unblocked after {(self._last_beat - stalled_since) * 1000:.0f} ms")
+                stalled_since = None
+
+    def status(self):
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+        }
+
+class SharedProfilingState:
+    """
+    Profiler settings shared by all workers through a small JSON file in PROFILE_DIR.
+
+    Arming the profiler through any worker rewrites the file and every worker re-reads
+    it at most every `check_interval` seconds. The "next N requests" budget is claimed
+    under a file lock, so it is spent across all workers together.
+    """
+
+    DEFAULTS = {
+        "remaining_requests": 0,
+        "latency_threshold": None,
+        "sample_interval": PROFILE_SAMPLE_INTERVAL,
+        "watchdog_threshold": None,
+    }
+
+    def __init__(self, path, check_interval=PROFILE_STATE_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._state = dict(self.DEFAULTS)
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked_file(self, exclusive):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            yield f, {**self.DEFAULTS, **(state if isinstance(state, dict) else {})}
+
+    def _write(self, f, state):
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(state))
+        f.flush()
+
+    def _remember(self, state):
+        with self._lock:
+            self._state = state
+            self._checked_at = time.monotonic()
+        return state
+
+    def reload(self):
+        try:
+            with self._locked_file(exclusive=False) as (_, state):
+                return self._remember(state)
+        except OSError as e:
+            logging.error(f"Failed to read profiling state from {self.path}: {e}")
+            return self._remember(self._state)
+
+    def current(self):
+        """Shared settings, re-read if the last read is older than the check interval"""
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.check_interval:
+            return self.reload()
+        return self._state
+
+    def update(self, **changes):
+        with self._locked_file(exclusive=True) as (f, state):
+            state.update(changes)
+            self._write(f, state)
+        return self._remember(state)
+
+    def claim_request(self):
+        """Take one request from the shared "next N requests" budget, returning whether one was left"""
+        try:
+            with self._locked_file(exclusive=True) as (f, state):
+                claimed = state["remaining_requests"] > 0
+                if claimed:
+                    state["remaining_requests"] -= 1
+                    self._write(f, state)
+        except OSError as e:
+            logging.error(f"Failed to update profiling state in {self.path}: {e}")
+            return False
+        self._remember(state)
+        return claimed
+
+class RequestProfiler:
+    """
+    Sampling profiler that can be armed for the next N requests or for requests over a latency threshold.
+
+    While any profiled request is in flight, one background thread samples the stacks
+    of busy threads (event loop and worker threads running calls) every
+    `sample_interval` seconds into a single buffer; threads parked waiting for work are
+    skipped. A kept profile is the part of the buffer within its request's start and
+    end. Samples are process-wide, so a profile also contains work done concurrently
+    for other requests. Kept profiles are written to PROFILE_DIR as
+    `<request_id>.folded`, loadable by flamegraph.pl or speedscope, next to a
+    `<request_id>.json` summary.
+    """
+
+    def __init__(self, profile_dir=PROFILE_DIR, state=None):
+        self.profile_dir = profile_dir
+        self.state = state or SharedProfilingState(os.path.join(profile_dir, PROFILE_STATE_FILE))
+        self._active = {}
+        # (timestamp, folded stacks) samples shared by all active requests
+        self._samples = deque()
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def configure(self, next_requests=None, latency_threshold=None, sample_interval=None, watchdog_threshold=None):
+        """Change the shared settings, which every worker picks up"""
+        changes = {}
+        if next_requests is not None:
+            changes["remaining_requests"] = next_requests
+        if latency_threshold is not None:
+            changes["latency_threshold"] = latency_threshold if latency_threshold > 0 else None
+        if sample_interval is not None:
+            changes["sample_interval"] = sample_interval
+        if watchdog_threshold is not None:
+            changes["watchdog_threshold"] = watchdog_threshold
+        state = self.state.update(**changes)
+        logging.info(f"Profiler configured: next {state['remaining_requests']} requests, "
+                     f"latency threshold {state['latency_threshold']}s, interval {state['sample_interval']}s")
+
+    def start(self, request_id, path):
+        """Start profiling a request if armed; returns a handle for finish() or None"""
+        state = self.state.current()
+        forced = state["remaining_requests"] > 0 and self.state.claim_request()
+        if not forced and state["latency_threshold"] is None:
+            return None
+        handle = {"request_id": request_id, "path": path, "forced": forced, "started_at": time.monotonic()}
+        with self._lock:
+            self._active[id(handle)] = handle
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+                self._sampler.start()
+        return handle
+
+    def finish(self, handle, duration):
+        ended_at = time.monotonic()
+        latency_threshold = self.state.current()["latency_threshold"]
+        keep = handle["forced"] or (latency_threshold is not None and duration >= latency_threshold)
+        with self._lock:
+            self._active.pop(id(handle), None)
+            window = [stacks for timestamp, stacks in self._samples if handle["started_at"] <= timestamp <= ended_at] if keep else []
+            # Samples older than every remaining request are no longer needed
+            oldest = min((active["started_at"] for active in self._active.values()), default=None)
+            while self._samples and (oldest is None or self._samples[0][0] < oldest):
+                self._samples.popleft()
+        if keep:
+            samples = Counter()
+            for stacks in window:
+                samples.update(stacks)
+            self._store(handle, duration, samples)
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = tuple(
+                fold_stack(frame, names.get(thread_id, str(thread_id)))
+                for thread_id, frame in sys._current_frames().items()
+                if thread_id != own_id and names.get(thread_id) != "loop-watchdog" and not is_idle(frame)
+            )
+            with self._lock:
+                self._samples.append((time.monotonic(), stacks))
+            time.sleep(self.state.current()["sample_interval"])
+
+    def profile_path(self, request_id):
+        return os.path.join(self.profile_dir, f"{request_id}.folded")
+
+    def _store(self, handle, duration, samples):
+        request_id = handle["request_id"]
+        summary = {
+            "path": handle["path"],
+            "duration_ms": round(duration * 1000, 1),
+            "samples": sum(samples.values()),
+            "pid": os.getpid(),
+        }
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(self.profile_path(request_id), "w") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            with open(os.path.join(self.profile_dir, f"{request_id}.json"), "w") as f:
+                json.dump(summary, f)
+        except OSError as e:
+            logging.error(f"Failed to write profile for request {request_id}: {e}")
+            return
+        logging.info(f"Stored profile for request {request_id} ({handle['path']}, {duration * 1000:.0f} ms)")
+
+        # Keep the newest MAX_STORED_PROFILES profiles of all workers
+        for old_request_id in list(self.stored_profiles())[:-MAX_STORED_PROFILES]:
+            for extension in ("folded", "json"):
+                try:
+                    os.remove(os.path.join(self.profile_dir, f"{old_request_id}.{extension}"))
+                except OSError:
+                    pass
+
+    def stored_profiles(self):
+        """Summaries of the stored profiles of all workers, oldest first"""
+        profiles = []
+        try:
+            names = os.listdir(self.profile_dir)
+        except FileNotFoundError:
+            return {}
+        for name in names:
+            request_id, extension = os.path.splitext(name)
+            if extension != ".json" or not is_valid_request_id(request_id):
+                continue
+            path = os.path.join(self.profile_dir, name)
+            try:
+                with open(path, "r") as f:
+                    profiles.append((os.path.getmtime(path), request_id, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return {request_id: summary for _, request_id, summary in sorted(profiles)}
+
+    def status(self):
+        state = self.state.reload()
+        return {
+            "remaining_requests": state["remaining_requests"],
+            "latency_threshold_ms": state["latency_threshold"] * 1000 if state["latency_threshold"] else None,
+            "sample_interval_ms": state["sample_interval"] * 1000,
+            "active_requests": len(self._active),
+            "profiles": self.stored_profiles(),
+        }
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that tags each request with a request id and profiles it when the profiler is armed
+    """
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header_name = REQUEST_ID_HEADER.lower().encode()
+        request_id = dict(scope["headers"]).get(header_name, b"").decode("latin-1")
+        if not is_valid_request_id(request_id):
+            request_id = uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(header_name, request_id.encode())]
+            await send(message)
+
+        # Routes are served both with and without the root path (/api)
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        profiled = not any(path == prefix or path.startswith(prefix + "/") for prefix in UNPROFILED_PATHS)
+
+        handle = self.profiler.start(request_id, scope["path"]) if profiled else None
+        start_time = time.monotonic()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if handle is not None:
+                await asyncio.to_thread(self.profiler.finish, handle, time.monotonic() - start_time)
+
+profiling_state = SharedProfilingState(os.path.join(PROFILE_DIR, PROFILE_STATE_FILE))
+request_profiler = RequestProfiler(state=profiling_state)
+loop_watchdog = LoopLagWatchdog(state=profiling_state)
@@ -0,0 +1,180 @@
+import logging
+import json
+import re
+import asyncio
+from .config import SHARD_TOKEN_BUDGET, MAX_CONCURRENT_SHARDS
+from .bedrock_service import call_bedrock
+
+NO_MATCH = "No match found"
+CONFIDENCE_RANK = {"high": 3, "medium": 2, "low": 1}
+MATCH_TYPE_RANK = {"exact": 3, "partial": 2, "phonetic": 1}
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("BFPV", "1"),
+    **dict.fromkeys("CGJKQSXZ", "2"),
+    **dict.fromkeys("DT", "3"),
+    "L": "4",
+    **dict.fromkeys("MN", "5"),
+    "R": "6",
+}
+
+def normalize_keyword(word: str) -> str:
+    """Case-, whitespace- and quote-insensitive form of a keyword, for comparing model answers"""
+    return " ".join(word.split()).strip(' ."\'').upper()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+def soundex(word: str) -> str:
+    """
+    Soundex code of the first word of a keyword, used to keep similar-sounding keywords together
+    """
+    letters = [c for c in word.upper() if c.isalpha()]
+    if not letters:
+        return word.upper()
+    code = letters[0]
+    previous = SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in "HW":
+            previous = digit
+    return code.ljust(4, "0")
+
+def split_dictionary(system_prompt: str):
+    """
+    Locate the keyword dictionary in a matching prompt.
+
+    The dictionary is either wrapped in <dictionary> tags or is the JSON object that
+    follows the last "Dictionary:" label (as produced from pe_template.txt). Returns
+    (prefix, entries, suffix) or None if no JSON dictionary could be found.
+    """
+    tagged = re.search(r'<dictionary>(.*?)</dictionary>', system_prompt, re.DOTALL)
+    if tagged:
+        start, end = tagged.span(1)
+    else:
+        label = system_prompt.rfind("Dictionary:")
+        start = system_prompt.find("{", label) if label != -1 else -1
+        end = system_prompt.rfind("}") + 1
+        if start == -1 or end <= start:
+            return None
+    try:
+        entries = json.loads(system_prompt[start:end])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(entries, dict):
+        return None
+    return system_prompt[:start], entries, system_prompt[end:]
+
+def build_shards(entries: dict, token_budget: int = SHARD_TOKEN_BUDGET):
+    """
+    Partition dictionary entries into shards of at most `token_budget` tokens.
+
+    Keywords are ordered by their Soundex code first, so that confusable keywords
+    land in the same shard and compete with each other in a single call.
+    """
+    shards = []
+    current, current_tokens = {}, 0
+    for keyword in sorted(entries, key=lambda k: (soundex(k), k.upper())):
+        entry_tokens = estimate_tokens(json.dumps({keyword: entries[keyword]}, ensure_ascii=False))
+        if current and current_tokens + entry_tokens > token_budget:
+            shards.append(current)
+            current, current_tokens = {}, 0
+        current[keyword] = entries[keyword]
+        current_tokens += entry_tokens
+    if current:
+        shards.append(current)
+    return shards
+
+def parse_match_result(result: str):
+    """
+    Parse a "Matched Word / Match Type / Confidence" answer, returning None for no match
+    """
+    if NO_MATCH.lower() in result.lower():
+        return None
+    fields = {}
+    for key, name in (("word", "Matched Word"), ("match_type", "Match Type"), ("confidence", "Confidence")):
+        match = re.search(rf'{name}:\s*\[?([^\]\n]+)\]?', result, re.IGNORECASE)
+        fields[key] = match.group(1).strip() if match else ""
+    if not fields["word"]:
+        return None
+    return fields
+
+def format_match_result(match) -> str:
+    if match is None:
+        return NO_MATCH
+    return f"Matched Word: {match['word']}\nMatch Type: {match['match_type']}\nConfidence: {match['confidence']}"
+
+def rank_match(match):
+    return (
+        CONFIDENCE_RANK.get(match["confidence"].lower(), 0),
+        MATCH_TYPE_RANK.get(match["match_type"].lower(), 0),
+    )
+
+async def sharded_match(transcript: str, system_prompt: str, session, model_name: str,
+                        shard_model_name: str = None, arbitrate: bool = False, deadline=None):
+    """
+    Match a transcript against a large dictionary by querying dictionary shards concurrently.
+
+    Each shard is sent with the same prompt to `shard_model_name` (a fast model,
+    defaulting to `model_name`). Shard winners are merged by confidence and match
+    type; with `arbitrate` a final call on `model_name` picks among the winners.
+    If any shard call fails the match fails, rather than answering from the other
+    shards. Prompts without a parseable dictionary fall back to a single call.
+    """
+    parts = split_dictionary(system_prompt)
+    if parts is None:
+        logging.warning("No JSON dictionary found in system prompt, falling back to a single call")
+        return await call_bedrock(transcript, system_prompt, session, model_name, deadline)
+
+    prefix, entries, suffix = parts
+    shards = build_shards(entries)
+    shard_model_name = shard_model_name or model_name
+    logging.info(f"Sharded matching: {len(entries)} keywords in {len(shards)} shards using {shard_model_name}")
+    if len(shards) <= 1:
+        return await call_bedrock(transcript, system_prompt, session, model_name, deadline)
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SHARDS)
+
+    async def match_shard(shard):
+        shard_prompt = prefix + json.dumps(shard, ensure_ascii=False) + suffix
+        async with semaphore:
+            result = await call_bedrock(transcript, shard_prompt, session, shard_model_name, deadline)
+        match = parse_match_result(result)
+        if match is None:
+            return None
+        # Map the answer back to the shard's own keyword, ignoring keywords from elsewhere
+        keywords = {normalize_keyword(keyword): keyword for keyword in shard}
+        keyword = keywords.get(normalize_keyword(match["word"]))
+        if keyword is None:
+            logging.warning(f"Shard answer {match['word']} is not a keyword of its shard, ignoring")
+            return None
+        match["word"] = keyword
+        return match
+
+    # A failed shard may hold the right keyword, so any failure fails the whole match
+    # and cancels the shards still in flight
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(match_shard(shard)) for shard in shards]
+    except ExceptionGroup as e:
+        logging.error(f"Shard matching failed: {e.exceptions[0]}")
+        raise e.exceptions[0]
+    winners = [task.result() for task in tasks if task.result()]
+
+    if not winners:
+        return NO_MATCH
+
+    winners.sort(key=rank_match, reverse=True)
+    logging.info(f"Shard winners: {[(w['word'], w['confidence']) for w in winners]}")
+    if not arbitrate or len(winners) == 1:
+        return format_match_result(winners[0])
+
+    # Final arbitration over the shard winners only
+    finalists = {w["word"]: entries[w["word"]] for w in winners}
+    arbitration_prompt = prefix + json.dumps(finalists, ensure_ascii=False) + suffix
+    return await call_bedrock(transcript, arbitration_prompt, session, model_name, deadline)
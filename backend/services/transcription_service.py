@@ -1,91 +1,142 @@
 import logging
 import uuid
-import json
 import asyncio
 import requests
 from fastapi import HTTPException
 from urllib.parse import urlparse
-from .config import SUPPORTED_MODELS
+from .config import TRANSCRIPT_FETCH_TIMEOUT
+from .model_registry import model_registry
+from .aws_utils import get_aws_client
 from .bedrock_service import call_bedrock
+from .deadline_utils import Deadline, run_blocking
 
-async def transcribe_audio(session, s3_audio_url: str, system_prompt: str, model_name: str):
+def delete_transcription_job(transcribe, job_name: str):
+    """
+    Delete a transcription job, logging instead of raising on failure
+    """
+    try:
+        transcribe.delete_transcription_job(TranscriptionJobName=job_name)
+        logging.info(f"Deleted transcription job: {job_name}")
+    except Exception as e:
+        # The job does not exist when starting it failed
+        error_code = getattr(e, "response", {}).get("Error", {}).get("Code")
+        if error_code in ("NotFoundException", "BadRequestException"):
+            logging.info(f"Transcription job {job_name} not found, nothing to delete")
+        else:
+            logging.warning(f"Failed to delete transcription job: {str(e)}")
+
+async def cleanup_transcription_job(start_job, transcribe, job_name: str):
+    """
+    Delete a transcription job once the call that starts it has returned
+    """
+    # The start call keeps running in its thread after a cancellation, and the job
+    # only exists once it returns, so deleting earlier could miss it
+    try:
+        await start_job
+    except Exception:
+        pass
+    await run_blocking(None, "transcription cleanup", delete_transcription_job, transcribe, job_name)
+
+async def transcribe_audio(session, s3_audio_url: str, system_prompt: str, model_name: str, deadline: Deadline = None):
     """
     Transcribe audio from S3 and process with Bedrock
+
+    If the request is cancelled (client disconnect or deadline expiry) the
+    transcription job is deleted and no Bedrock call is made.
     """
     try:
         # Validate inputs
         if not all([s3_audio_url, system_prompt, model_name]):
             raise HTTPException(status_code=400, detail="Missing required fields")
 
-        # Log SUPPORTED_MODELS content
-        logging.info("=== SUPPORTED MODELS IN TRANSCRIBE SERVICE ===")
-        logging.info(json.dumps(SUPPORTED_MODELS, indent=2))
-        logging.info("============================================")
         logging.info(f"Requested model name: {model_name}")
 
-        if model_name not in SUPPORTED_MODELS:
+        if model_name not in model_registry:
             logging.error(f"Model {model_name} not found in supported models")
             raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
 
         logging.info(f"Received transcribe request for S3 audio file: {s3_audio_url} using model: {model_name}")
 
         # Initialize Transcribe client
-        transcribe = session.client('transcribe')
+        transcribe = get_aws_client(session, 'transcribe')
 
         # Generate unique job name
         job_name = f'transcribe-job-{str(uuid.uuid4())}'
 
-        # Start transcription job
-        try:
-            transcribe.start_transcription_job(
-                TranscriptionJobName=job_name,
-                Media={'MediaFileUri': s3_audio_url},
-                MediaFormat='mp3',  # Adjust based on input format
-                LanguageCode='en-US'
-            )
-            logging.info(f"Started transcription job: {job_name}")
-        except Exception as e:
-            logging.error(f"Error starting transcription job: {e}")
-            raise HTTPException(status_code=500, detail=f"Transcription job failed: {str(e)}")
-
-        # Wait for transcription completion
-        while True:
-            status = transcribe.get_transcription_job(TranscriptionJobName=job_name)
-            if status['TranscriptionJob']['TranscriptionJobStatus'] in ['COMPLETED', 'FAILED']:
-                break
-            await asyncio.sleep(1)
-
-        if status['TranscriptionJob']['TranscriptionJobStatus'] == 'FAILED':
-            logging.error(f"Transcription job failed: {status['TranscriptionJob']['Failure']['FailureReason']}")
-            raise HTTPException(status_code=500, detail="Transcription job failed")
-
-        # Get transcription result
-        transcript_uri = status['TranscriptionJob']['Transcript']['TranscriptFileUri']
-        try:
-            transcript_response = requests.get(transcript_uri)
-            transcript_response.raise_for_status()
-            transcript_text = transcript_response.json()['results']['transcripts'][0]['transcript']
-            logging.info(f"Transcription result: {transcript_text}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error retrieving transcription result: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to retrieve transcription result: {str(e)}")
-        except (ValueError, KeyError) as e:
-            logging.error(f"Invalid transcription result format: {e}")
-            raise HTTPException(status_code=500, detail=f"Invalid transcription result format: {str(e)}")
-
-        # Log before calling Bedrock
-        logging.info("About to call Bedrock with transcription result")
-        logging.info(f"Using model: {model_name}")
-        logging.info(f"transcript_text : {transcript_text}")
-
-        # Call Bedrock Claude with the specified model
-        bedrock_result = await call_bedrock(transcript_text, system_prompt, session, model_name)
-
-        # Clean up transcription job
+        if deadline is not None:
+            deadline.check("transcription start")
+        # Start transcription job; from here on the job is deleted however the request ends
+        start_job = asyncio.ensure_future(run_blocking(
+            None,
+            "transcription start",
+            transcribe.start_transcription_job,
+            TranscriptionJobName=job_name,
+            Media={'MediaFileUri': s3_audio_url},
+            MediaFormat='mp3',  # Adjust based on input format
+            LanguageCode='en-US'
+        ))
         try:
-            transcribe.delete_transcription_job(TranscriptionJobName=job_name)
-        except Exception as e:
-            logging.warning(f"Failed to delete transcription job: {str(e)}")
+            try:
+                await asyncio.wait_for(asyncio.shield(start_job), None if deadline is None else deadline.remaining())
+                logging.info(f"Started transcription job: {job_name}")
+            except asyncio.TimeoutError:
+                logging.warning(f"Deadline of {deadline.timeout:.1f}s exceeded during transcription start")
+                raise HTTPException(status_code=504, detail="Deadline exceeded during transcription start")
+            except Exception as e:
+                logging.error(f"Error starting transcription job: {e}")
+                raise HTTPException(status_code=500, detail=f"Transcription job failed: {str(e)}")
+
+            # Wait for transcription completion
+            while True:
+                status = await run_blocking(
+                    deadline,
+                    "transcription",
+                    transcribe.get_transcription_job,
+                    TranscriptionJobName=job_name
+                )
+                if status['TranscriptionJob']['TranscriptionJobStatus'] in ['COMPLETED', 'FAILED']:
+                    break
+                await asyncio.sleep(1)
+
+            if status['TranscriptionJob']['TranscriptionJobStatus'] == 'FAILED':
+                logging.error(f"Transcription job failed: {status['TranscriptionJob']['Failure']['FailureReason']}")
+                raise HTTPException(status_code=500, detail="Transcription job failed")
+
+            # Get transcription result
+            transcript_uri = status['TranscriptionJob']['Transcript']['TranscriptFileUri']
+            try:
+                fetch_timeout = TRANSCRIPT_FETCH_TIMEOUT if deadline is None else min(TRANSCRIPT_FETCH_TIMEOUT, deadline.remaining())
+                transcript_response = await run_blocking(
+                    deadline,
+                    "transcript download",
+                    requests.get,
+                    transcript_uri,
+                    timeout=fetch_timeout
+                )
+                transcript_response.raise_for_status()
+                transcript_text = transcript_response.json()['results']['transcripts'][0]['transcript']
+                logging.info(f"Transcription result: {transcript_text}")
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Error retrieving transcription result: {e}")
+                raise HTTPException(status_code=500, detail=f"Failed to retrieve transcription result: {str(e)}")
+            except (ValueError, KeyError) as e:
+                logging.error(f"Invalid transcription result format: {e}")
+                raise HTTPException(status_code=500, detail=f"Invalid transcription result format: {str(e)}")
+
+            # Log before calling Bedrock
+            logging.info("About to call Bedrock with transcription result")
+            logging.info(f"Using model: {model_name}")
+            logging.info(f"transcript_text : {transcript_text}")
+
+            # Call Bedrock Claude with the specified model
+            bedrock_result = await call_bedrock(transcript_text, system_prompt, session, model_name, deadline)
+
+        except asyncio.CancelledError:
+            logging.warning(f"Transcribe request cancelled, stopping transcription job: {job_name}")
+            raise
+        finally:
+            # Clean up transcription job off the event loop; shielded so it completes even when cancelled
+            await asyncio.shield(cleanup_transcription_job(start_job, transcribe, job_name))
 
         return {
             'transcript': transcript_text,